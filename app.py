@@ -1,12 +1,23 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-import psycopg2 
-import psycopg2.extras 
-from psycopg2 import errors as pg_errors 
+# psycopg2 y requests se importan dentro de las funciones que los usan: así cada
+# worker arranca sin pagar su carga hasta que de verdad los necesita
+from flask import Flask, Response, g, has_request_context, render_template, request, redirect, stream_with_context, url_for, session, flash, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
+import csv
+import hashlib
+import io
+import itertools
+import json
 import os
+import queue
+import re
+import select
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 from dotenv import load_dotenv
-import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
 
 load_dotenv()
 
@@ -14,18 +25,282 @@ APP_SECRET = os.getenv("APP_SECRET", "cambia_esto_ya")
 DISCORD_WEBHOOK = os.getenv("DISCORD_WEBHOOK")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))        # segundos esperando conexión libre
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "1800"))     # edad máxima de una conexión
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))  # validar si lleva este tiempo inactiva
+
+OUTBOX_DISPATCHER = os.getenv("OUTBOX_DISPATCHER", "thread")  # "thread" o "off" (usar `python app.py dispatch`)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_POLL = float(os.getenv("OUTBOX_POLL", "15"))
+OUTBOX_LOCK = (0x53414e43, 2)  # advisory lock del despachador activo
+DISCORD_MAX_EMBEDS = 10       # límites de Discord por mensaje
+DISCORD_MAX_EMBED_CHARS = 6000
+
+SANCION_COLUMNS = ("id", "fecha", "objetivo", "discord_id", "accion", "motivo", "gravedad", "conteo", "pruebas", "moderador", "created_at")
+HISTORIAL_LIMIT = 20
+HISTORIAL_LIMIT_MAX = 200
+BATCH_MAX = 100          # objetivos por envío múltiple
+EXPORT_CHUNK = 2000      # filas por fetchmany del cursor de servidor
+IMPORT_CHUNK = 5000      # filas por COPY FROM STDIN
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = sin log de peticiones lentas
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")                  # si está, /metrics exige "Bearer <token>"
+
+STATS_TTL = float(os.getenv("STATS_TTL", "30"))  # segundos que /api/stats sirve desde memoria
+STATS_DIAS = 30
+STATS_LOCK = (0x53414e43, 3)  # advisory lock de quien vuelca stats_pendientes en los resúmenes
+
+ACCIONES = ("sancionar", "desancionar", "advertir")
+GRAVEDADES = ("Baja", "Media", "Alta", "Crítica")
+IMPORT_COLUMNS = ("fecha", "objetivo", "discord_id", "accion", "motivo", "gravedad", "conteo", "pruebas", "moderador", "created_at")
+
+MIGRATION_BATCH = int(os.getenv("MIGRATION_BATCH", "5000"))
+# Las fechas antiguas escritas desde el formulario (datetime-local) estaban en hora local
+LEGACY_FORM_TZ = os.getenv("LEGACY_FORM_TZ", "Europe/Madrid")
+
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+SSE_BACKLOG = 200        # filas reenviadas como máximo al reanudar; si faltan más, el panel recarga
+SSE_QUEUE_MAX = 500      # un cliente más lento que esto se desconecta y reanuda
+SSE_RECENT = 1000        # filas recientes por worker, en orden de commit, para reanudar sin huecos
+NOTIFY_IDS = 300         # ids por NOTIFY (el payload tiene que quedar por debajo de 8000 bytes)
+
 app = Flask(__name__)
 app.secret_key = APP_SECRET
 
+# -------------- Metrics --------------
+# Con varios workers, gunicorn.conf.py define PROMETHEUS_MULTIPROC_DIR y /metrics agrega todos
+REQUEST_SECONDS = Histogram("panel_request_seconds", "Latencia total de cada petición",
+                            ["route", "method", "status"])
+PHASE_SECONDS = Histogram("panel_request_phase_seconds",
+                          "Tiempo por fase dentro de cada petición (db, db_acquire, password_hash)",
+                          ["route", "phase"])
+WEBHOOK_SECONDS = Histogram("panel_webhook_seconds", "Duración de cada POST al webhook de Discord", ["result"])
+POOL_WAIT_SECONDS = Histogram("panel_db_pool_wait_seconds", "Espera hasta obtener una conexión libre del pool")
+POOL_CHECKOUT_FAILURES = Counter("panel_db_pool_checkout_failures", "Checkouts del pool que fallaron o agotaron el timeout")
+POOL_CONNECTIONS = Gauge("panel_db_pool_connections", "Conexiones del pool por estado",
+                         ["state"], multiprocess_mode="livesum")
+
+def observe_phase(phase, seconds):
+    # Dentro de una petición se acumula y se publica al terminar (ver record_request)
+    if has_request_context() and "timings" in g:
+        g.timings[phase] = g.timings.get(phase, 0.0) + seconds
+    else:
+        PHASE_SECONDS.labels("background", phase).observe(seconds)
+
+def observe_phases(route, timings):
+    for phase, seconds in timings.items():
+        PHASE_SECONDS.labels(route, phase).observe(seconds)
+
+@contextmanager
+def timed(phase):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - t0)
+
 # -------------- DB helpers --------------
-def get_db():
+class PoolTimeout(Exception):
+    pass
+
+# "db" es el tiempo dentro de las consultas (execute/copy/fetch), no el de la conexión
+# prestada: las conexiones del pool crean cursores que se miden solos
+_timed_cursors = {}
+_timed_connection = None
+
+def timed_cursor(base):
+    cls = _timed_cursors.get(base)
+    if cls is None:
+        def wrap(method):
+            def timed_method(self, *args, **kwargs):
+                with timed("db"):
+                    return method(self, *args, **kwargs)
+            return timed_method
+        methods = ("execute", "executemany", "callproc", "copy_expert", "fetchone", "fetchmany", "fetchall")
+        cls = _timed_cursors[base] = type(f"Timed{base.__name__}", (base,),
+                                          {m: wrap(getattr(base, m)) for m in methods})
+    return cls
+
+def timed_connection():
+    global _timed_connection
+    if _timed_connection is None:
+        import psycopg2.extensions
+
+        class TimedConnection(psycopg2.extensions.connection):
+            def cursor(self, *args, **kwargs):
+                base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+                kwargs["cursor_factory"] = timed_cursor(base)
+                return super().cursor(*args, **kwargs)
+
+        _timed_connection = TimedConnection
+    return _timed_connection
+
+# Pool de conexiones por proceso: cada worker de gunicorn tiene el suyo
+class DBPool:
+    def __init__(self, dsn, minconn, maxconn, timeout, recycle, ping_after):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []     # [(conn, last_used)]
+        self._born = {}     # id(conn) -> instante de creación
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "checkout_failures": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "connects": 0,
+            "recycled": 0,
+            "discarded": 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn, connection_factory=timed_connection())
+        with self._lock:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["connects"] += 1
+        return conn
+
+    def _close(self, conn, stat):
+        with self._lock:
+            self._born.pop(id(conn), None)
+            self._stats[stat] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn, last_used):
+        import psycopg2
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.recycle and now - self._born.get(id(conn), now) > self.recycle:
+            return False
+        if self.ping_after and now - last_used > self.ping_after:
+            try:
+                with conn.cursor() as c:
+                    c.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def getconn(self):
+        t0 = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["checkout_failures"] += 1
+            POOL_CHECKOUT_FAILURES.inc()
+            raise PoolTimeout(f"No hay conexiones libres tras {self.timeout}s")
+        waited = time.monotonic() - t0
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._connect()
+                elif self._usable(*item):
+                    conn = item[0]
+                else:
+                    self._close(item[0], "recycled")
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._stats["checkout_failures"] += 1
+            POOL_CHECKOUT_FAILURES.inc()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += waited
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], waited)
+            self._publish()
+        POOL_WAIT_SECONDS.observe(waited)
+        return conn
+
+    def _publish(self):
+        # Llamar con self._lock
+        POOL_CONNECTIONS.labels("in_use").set(self._in_use)
+        POOL_CONNECTIONS.labels("idle").set(len(self._idle))
+
+    def putconn(self, conn, discard=False):
+        import psycopg2.extensions
+        try:
+            if not discard and not conn.closed:
+                # Nunca devolvemos al pool una conexión con una transacción abierta
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            else:
+                discard = True
+        except psycopg2.Error:
+            discard = True
+        if discard:
+            self._close(conn, "discarded")
+        else:
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        with self._lock:
+            self._in_use -= 1
+            self._publish()
+        self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn, "discarded")
+
+    def stats(self):
+        with self._lock:
+            st = dict(self._stats)
+            st.update(in_use=self._in_use, idle=len(self._idle),
+                      min=self.minconn, max=self.maxconn, pid=self.pid)
+        st["wait_time_avg"] = st["wait_time_total"] / st["checkouts"] if st["checkouts"] else 0.0
+        return st
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
     if not DATABASE_URL:
         raise ValueError("No se encontró DATABASE_URL en las variables de entorno")
-    conn = psycopg2.connect(DATABASE_URL)
-    return conn
+    # Tras un fork (gunicorn --preload) las conexiones heredadas comparten socket
+    # con el proceso padre: se abandonan sin cerrarlas y se crea un pool nuevo.
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = DBPool(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                               DB_POOL_RECYCLE, DB_POOL_PING_AFTER)
+    return _pool
 
-def init_db():
-    conn = get_db()
+@contextmanager
+def get_db():
+    pool = get_pool()
+    with timed("db_acquire"):
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        # También con GeneratorExit (respuestas en streaming que el cliente corta);
+        # putconn deshace cualquier transacción que siga abierta
+        pool.putconn(conn)
+
+# -------------- Migrations --------------
+def _m1_base(conn):
     with conn.cursor() as c:
         c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -49,57 +324,964 @@ def init_db():
             created_at TEXT NOT NULL
         )
         """)
-    conn.commit() 
-    conn.close()
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS webhook_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            sancion_id INTEGER REFERENCES sanciones(id),
+            embed JSONB NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            intentos INTEGER NOT NULL DEFAULT 0,
+            siguiente_intento TIMESTAMPTZ NOT NULL DEFAULT now(),
+            ultimo_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            enviado_at TIMESTAMPTZ
+        )
+        """)
+        c.execute("""
+        CREATE INDEX IF NOT EXISTS webhook_outbox_pendientes
+            ON webhook_outbox (siguiente_intento) WHERE estado = 'pendiente'
+        """)
+    conn.commit()
 
-# -------------- Auth helpers --------------
-def create_user(username, password):
-    pw_hash = generate_password_hash(password)
-    conn = get_db()
+LEGACY_OBJETIVO_RE = re.compile(r"^(.*) \(ID: (\d{1,19})\)$")
+
+def _legacy_ts(value, tz=timezone.utc):
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz)
+    return dt
+
+def _legacy_row(objetivo, fecha, created_at, form_tz):
+    # Devuelve (discord_id, objetivo, fecha_tz, created_tz) de una fila en texto
+    discord_id = None
+    m = LEGACY_OBJETIVO_RE.match(objetivo or "")
+    if m and int(m.group(2)) < 2**63:
+        objetivo, discord_id = m.group(1), int(m.group(2))
+    # "YYYY-MM-DDTHH:MM" venía del formulario; "YYYY-MM-DD HH:MM:SS" de utcnow()
+    fecha_tz = _legacy_ts(fecha, form_tz if fecha and "T" in fecha else timezone.utc)
+    created_tz = _legacy_ts(created_at) or fecha_tz or datetime.now(timezone.utc)
+    return discord_id, objetivo, fecha_tz, created_tz
+
+def _backfill_sanciones(cur, last_id):
+    import psycopg2.extras
+    from zoneinfo import ZoneInfo
+    form_tz = ZoneInfo(LEGACY_FORM_TZ)
+    cur.execute("""
+        SELECT id, fecha, objetivo, created_at FROM sanciones
+        WHERE id > %s AND created_at_tz IS NULL
+        ORDER BY id LIMIT %s
+    """, (last_id, MIGRATION_BATCH))
+    rows = cur.fetchall()
+    values = [(sid, *_legacy_row(objetivo, fecha, created_at, form_tz))
+              for sid, fecha, objetivo, created_at in rows]
+    if values:
+        psycopg2.extras.execute_values(cur, """
+            UPDATE sanciones SET discord_id = v.discord_id, objetivo = v.objetivo,
+                fecha_tz = v.fecha_tz, created_at_tz = v.created_tz
+            FROM (VALUES %s) AS v (id, discord_id, objetivo, fecha_tz, created_tz)
+            WHERE sanciones.id = v.id
+        """, values, template="(%s, %s::bigint, %s, %s::timestamptz, %s::timestamptz)")
+    return rows[-1][0] if rows else None
+
+def _has_column(cur, table, column):
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone() is not None
+
+def _m2_typed_sanciones(conn):
+    with conn.cursor() as c:
+        if _has_column(c, "sanciones", "discord_id") and not _has_column(c, "sanciones", "fecha_tz"):
+            conn.commit()
+            return  # ya migrada (se cortó antes de registrar la versión)
+        # Columnas nuevas nulas: no reescribe la tabla
+        c.execute("""
+            ALTER TABLE sanciones
+                ADD COLUMN IF NOT EXISTS discord_id BIGINT,
+                ADD COLUMN IF NOT EXISTS fecha_tz TIMESTAMPTZ,
+                ADD COLUMN IF NOT EXISTS created_at_tz TIMESTAMPTZ
+        """)
+        conn.commit()
+
+        # Relleno por lotes, cada uno en su propia transacción corta
+        last_id = 0
+        while last_id is not None:
+            last_id = _backfill_sanciones(c, last_id)
+            conn.commit()
+
+        # Intercambio de columnas: solo metadatos más las filas que llegaron durante el relleno
+        c.execute("LOCK TABLE sanciones IN ACCESS EXCLUSIVE MODE")
+        last_id = 0
+        while last_id is not None:
+            last_id = _backfill_sanciones(c, last_id)
+        c.execute("""
+            ALTER TABLE sanciones
+                DROP COLUMN fecha,
+                DROP COLUMN created_at
+        """)
+        c.execute("ALTER TABLE sanciones RENAME COLUMN fecha_tz TO fecha")
+        c.execute("ALTER TABLE sanciones RENAME COLUMN created_at_tz TO created_at")
+        c.execute("""
+            ALTER TABLE sanciones
+                ALTER COLUMN created_at SET DEFAULT now(),
+                ALTER COLUMN created_at SET NOT NULL
+        """)
+    conn.commit()
+
+def _m3_sanciones_indexes(conn):
+    # CONCURRENTLY no bloquea escrituras, pero no puede ir dentro de una transacción
+    conn.commit()
+    conn.autocommit = True
     try:
         with conn.cursor() as c:
-            c.execute("INSERT INTO users (username, password_hash, created_at) VALUES (%s, %s, %s)",
-                     (username, pw_hash, datetime.utcnow().isoformat()))
+            for name, columns in (("sanciones_discord_id_idx", "discord_id, id"),
+                                  ("sanciones_moderador_idx", "moderador, id"),
+                                  ("sanciones_created_at_idx", "created_at")):
+                # Un CONCURRENTLY que falló deja el índice INVALID con ese nombre: IF NOT
+                # EXISTS lo daría por bueno, así que se borra y se vuelve a crear
+                c.execute("""
+                    SELECT NOT i.indisvalid FROM pg_index i
+                    WHERE i.indexrelid = to_regclass(%s)
+                """, (name,))
+                row = c.fetchone()
+                if row and row[0]:
+                    c.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                c.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON sanciones ({columns})")
+    finally:
+        conn.autocommit = False
+
+def _m4_sanciones_notify(conn):
+    # Un NOTIFY por sentencia (no por fila) con el id más alto insertado;
+    # los listeners leen de la tabla todo lo posterior a su último id
+    with conn.cursor() as c:
+        c.execute("""
+        CREATE OR REPLACE FUNCTION sanciones_notify() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('sanciones', (SELECT max(id) FROM nuevas)::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+        c.execute("DROP TRIGGER IF EXISTS sanciones_notify ON sanciones")
+        c.execute("""
+        CREATE TRIGGER sanciones_notify AFTER INSERT ON sanciones
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION sanciones_notify()
+        """)
+    conn.commit()
+
+def rebuild_stats(conn):
+    # Recalcula las tablas de resumen desde cero; SHARE frena los INSERT mientras tanto
+    with conn.cursor() as c:
+        c.execute("SELECT pg_advisory_xact_lock(%s, %s)", STATS_LOCK)
+        c.execute("LOCK TABLE sanciones IN SHARE MODE")
+        c.execute("TRUNCATE stats_moderador, stats_accion, stats_dia, stats_objetivo")
+        c.execute("SELECT to_regclass('stats_pendientes') IS NOT NULL")
+        if c.fetchone()[0]:
+            # Lo pendiente ya está contado en el recálculo
+            c.execute("TRUNCATE stats_pendientes")
+        c.execute("""
+            INSERT INTO stats_moderador (moderador, total)
+            SELECT coalesce(moderador, '—'), count(*) FROM sanciones GROUP BY 1
+        """)
+        c.execute("""
+            INSERT INTO stats_accion (accion, gravedad, total)
+            SELECT coalesce(accion, '—'), coalesce(gravedad, '—'), count(*) FROM sanciones GROUP BY 1, 2
+        """)
+        c.execute("""
+            INSERT INTO stats_dia (dia, total)
+            SELECT (created_at AT TIME ZONE 'UTC')::date, count(*) FROM sanciones GROUP BY 1
+        """)
+        c.execute("""
+            INSERT INTO stats_objetivo (discord_id, objetivo, total, ultima_id)
+            SELECT discord_id, (array_agg(objetivo ORDER BY id DESC))[1], count(*), max(id)
+            FROM sanciones WHERE discord_id IS NOT NULL GROUP BY 1
+        """)
+    conn.commit()
+
+def _m5_stats_rollups(conn):
+    with conn.cursor() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_moderador (
+            moderador TEXT PRIMARY KEY,
+            total BIGINT NOT NULL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_accion (
+            accion TEXT NOT NULL,
+            gravedad TEXT NOT NULL,
+            total BIGINT NOT NULL,
+            PRIMARY KEY (accion, gravedad)
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_dia (
+            dia DATE PRIMARY KEY,
+            total BIGINT NOT NULL
+        )
+        """)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_objetivo (
+            discord_id BIGINT PRIMARY KEY,
+            objetivo TEXT,
+            total BIGINT NOT NULL,
+            ultima_id INTEGER NOT NULL
+        )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS stats_objetivo_total_idx ON stats_objetivo (total DESC)")
+        # Una pasada por sentencia sobre las filas nuevas (sirve igual para COPY e INSERT
+        # múltiple). Los locks de los upserts duran hasta el commit: la versión 7 lo
+        # sustituye por stats_pendientes para no bloquear los INSERT concurrentes
+        c.execute("""
+        CREATE OR REPLACE FUNCTION sanciones_stats() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO stats_moderador (moderador, total)
+                SELECT coalesce(moderador, '—'), count(*) FROM nuevas GROUP BY 1 ORDER BY 1
+                ON CONFLICT (moderador) DO UPDATE SET total = stats_moderador.total + EXCLUDED.total;
+            INSERT INTO stats_accion (accion, gravedad, total)
+                SELECT coalesce(accion, '—'), coalesce(gravedad, '—'), count(*) FROM nuevas GROUP BY 1, 2 ORDER BY 1, 2
+                ON CONFLICT (accion, gravedad) DO UPDATE SET total = stats_accion.total + EXCLUDED.total;
+            INSERT INTO stats_dia (dia, total)
+                SELECT (created_at AT TIME ZONE 'UTC')::date, count(*) FROM nuevas GROUP BY 1 ORDER BY 1
+                ON CONFLICT (dia) DO UPDATE SET total = stats_dia.total + EXCLUDED.total;
+            INSERT INTO stats_objetivo (discord_id, objetivo, total, ultima_id)
+                SELECT discord_id, (array_agg(objetivo ORDER BY id DESC))[1], count(*), max(id)
+                FROM nuevas WHERE discord_id IS NOT NULL GROUP BY 1 ORDER BY 1
+                ON CONFLICT (discord_id) DO UPDATE SET total = stats_objetivo.total + EXCLUDED.total,
+                    objetivo = EXCLUDED.objetivo, ultima_id = EXCLUDED.ultima_id;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+        c.execute("DROP TRIGGER IF EXISTS sanciones_stats ON sanciones")
+        c.execute("""
+        CREATE TRIGGER sanciones_stats AFTER INSERT ON sanciones
+            REFERENCING NEW TABLE AS nuevas
+            FOR EACH STATEMENT EXECUTE FUNCTION sanciones_stats()
+        """)
+    rebuild_stats(conn)
+
+def _m6_sanciones_notify_ids(conn):
+    # El NOTIFY lleva los ids insertados: los ids no se confirman en orden, así
+    # que "todo lo posterior al último id" se saltaba filas de transacciones lentas
+    with conn.cursor() as c:
+        c.execute(f"""
+        CREATE OR REPLACE FUNCTION sanciones_notify() RETURNS trigger AS $$
+        DECLARE
+            ids text;
+        BEGIN
+            FOR ids IN
+                SELECT string_agg(id::text, ',' ORDER BY id) FROM (
+                    SELECT id, (row_number() OVER (ORDER BY id) - 1) / {NOTIFY_IDS} AS lote FROM nuevas
+                ) t GROUP BY lote ORDER BY lote
+            LOOP
+                PERFORM pg_notify('sanciones', ids);
+            END LOOP;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    conn.commit()
+
+def _m7_stats_pendientes(conn):
+    # El trigger solo apunta los ids nuevos (sin conflictos ni locks compartidos, así una
+    # importación larga no bloquea /send_sancion); fold_stats los vuelca a los resúmenes
+    with conn.cursor() as c:
+        c.execute("CREATE TABLE IF NOT EXISTS stats_pendientes (sancion_id INTEGER NOT NULL)")
+        c.execute("""
+        CREATE OR REPLACE FUNCTION sanciones_stats() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO stats_pendientes (sancion_id) SELECT id FROM nuevas;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    conn.commit()
+
+def _m8_sanciones_notify_importando(conn):
+    # Las importaciones (SET LOCAL panel.importando = on) no notifican fila a fila:
+    # al confirmar mandan un único 'reload' y los paneles recargan el historial
+    with conn.cursor() as c:
+        c.execute(f"""
+        CREATE OR REPLACE FUNCTION sanciones_notify() RETURNS trigger AS $$
+        DECLARE
+            ids text;
+        BEGIN
+            IF current_setting('panel.importando', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            FOR ids IN
+                SELECT string_agg(id::text, ',' ORDER BY id) FROM (
+                    SELECT id, (row_number() OVER (ORDER BY id) - 1) / {NOTIFY_IDS} AS lote FROM nuevas
+                ) t GROUP BY lote ORDER BY lote
+            LOOP
+                PERFORM pg_notify('sanciones', ids);
+            END LOOP;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """)
+    conn.commit()
+
+def fold_stats(conn):
+    # Solo una transacción a la vez (si otra ya está en ello, se sirve lo que haya);
+    # las filas de transacciones sin confirmar no son visibles y quedan para la próxima
+    with conn.cursor() as c:
+        c.execute("SELECT pg_try_advisory_xact_lock(%s, %s)", STATS_LOCK)
+        if c.fetchone()[0]:
+            c.execute("""
+                WITH pendientes AS (
+                    DELETE FROM stats_pendientes RETURNING sancion_id
+                ), nuevas AS MATERIALIZED (
+                    SELECT s.* FROM sanciones s JOIN pendientes p ON s.id = p.sancion_id
+                ), por_moderador AS (
+                    INSERT INTO stats_moderador (moderador, total)
+                    SELECT coalesce(moderador, '—'), count(*) FROM nuevas GROUP BY 1
+                    ON CONFLICT (moderador) DO UPDATE SET total = stats_moderador.total + EXCLUDED.total
+                ), por_accion AS (
+                    INSERT INTO stats_accion (accion, gravedad, total)
+                    SELECT coalesce(accion, '—'), coalesce(gravedad, '—'), count(*) FROM nuevas GROUP BY 1, 2
+                    ON CONFLICT (accion, gravedad) DO UPDATE SET total = stats_accion.total + EXCLUDED.total
+                ), por_dia AS (
+                    INSERT INTO stats_dia (dia, total)
+                    SELECT (created_at AT TIME ZONE 'UTC')::date, count(*) FROM nuevas GROUP BY 1
+                    ON CONFLICT (dia) DO UPDATE SET total = stats_dia.total + EXCLUDED.total
+                )
+                INSERT INTO stats_objetivo (discord_id, objetivo, total, ultima_id)
+                SELECT discord_id, (array_agg(objetivo ORDER BY id DESC))[1], count(*), max(id)
+                FROM nuevas WHERE discord_id IS NOT NULL GROUP BY 1
+                ON CONFLICT (discord_id) DO UPDATE SET total = stats_objetivo.total + EXCLUDED.total,
+                    objetivo = CASE WHEN EXCLUDED.ultima_id > stats_objetivo.ultima_id
+                                    THEN EXCLUDED.objetivo ELSE stats_objetivo.objetivo END,
+                    ultima_id = GREATEST(stats_objetivo.ultima_id, EXCLUDED.ultima_id)
+            """)
+    conn.commit()
+
+# (versión, descripción, función): se aplican en orden y una sola vez
+MIGRATIONS = [
+    (1, "tablas base", _m1_base),
+    (2, "sanciones: discord_id BIGINT y fechas TIMESTAMPTZ", _m2_typed_sanciones),
+    (3, "sanciones: índices por usuario, moderador y fecha", _m3_sanciones_indexes),
+    (4, "sanciones: NOTIFY al insertar", _m4_sanciones_notify),
+    (5, "estadísticas: tablas de resumen mantenidas por trigger", _m5_stats_rollups),
+    (6, "sanciones: NOTIFY con los ids insertados", _m6_sanciones_notify_ids),
+    (7, "estadísticas: el trigger apunta en stats_pendientes en vez de actualizar", _m7_stats_pendientes),
+    (8, "sanciones: sin NOTIFY por fila durante las importaciones", _m8_sanciones_notify_importando),
+]
+
+def migrate(conn):
+    with conn.cursor() as c:
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            descripcion TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """)
+        c.execute("SELECT version FROM schema_version")
+        applied = {r[0] for r in c.fetchall()}
+    conn.commit()
+    for version, descripcion, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        print(f"Aplicando migración {version}: {descripcion}")
+        fn(conn)
+        with conn.cursor() as c:
+            c.execute("INSERT INTO schema_version (version, descripcion) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                      (version, descripcion))
         conn.commit()
-        return True
-    except (psycopg2.IntegrityError, pg_errors.UniqueViolation):
-        conn.rollback() 
-        return False
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+MIGRATION_LOCK = (0x53414e43, 1)  # advisory lock (espacio de dos int4, no choca con los de discord_id)
+
+def init_db():
+    # Solo desde `python app.py migrate|bootstrap`, nunca al importar. Conexión propia
+    # fuera del pool: al cerrarla se libera el advisory lock pase lo que pase.
+    import psycopg2
+    if not DATABASE_URL:
+        raise ValueError("No se encontró DATABASE_URL en las variables de entorno")
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        # Se reintenta en autocommit en vez de bloquear en pg_advisory_lock: una sesión
+        # esperando con un snapshot abierto bloquearía CREATE INDEX CONCURRENTLY (deadlock)
+        conn.autocommit = True
+        with conn.cursor() as c:
+            waiting = False
+            while True:
+                c.execute("SELECT pg_try_advisory_lock(%s, %s)", MIGRATION_LOCK)
+                if c.fetchone()[0]:
+                    break
+                if not waiting:
+                    print("Otra migración está en curso, esperando...")
+                    waiting = True
+                time.sleep(1)
+        conn.autocommit = False
+        migrate(conn)
     finally:
         conn.close()
 
+def check_schema():
+    # Comprobación barata al arrancar cada worker: una consulta, sin DDL. Devuelve False
+    # solo si el esquema está desactualizado; None si no se ha podido comprobar (la base
+    # de datos caída no debe tumbar gunicorn: las peticiones ya fallarán o darán 503)
+    try:
+        with get_db() as conn, conn.cursor() as c:
+            c.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+            version = 0
+            if c.fetchone()[0]:
+                c.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+                version = c.fetchone()[0]
+    except Exception as e:
+        app.logger.error("No se pudo comprobar el esquema de la base de datos: %s", e)
+        return None
+    if version < SCHEMA_VERSION:
+        app.logger.error("Esquema en versión %s, se esperaba %s: ejecuta 'python app.py migrate'",
+                         version, SCHEMA_VERSION)
+        return False
+    return True
+
+# -------------- Auth helpers --------------
+def create_user(username, password):
+    import psycopg2
+    with timed("password_hash"):
+        pw_hash = generate_password_hash(password)
+    with get_db() as conn:
+        try:
+            with conn.cursor() as c:
+                c.execute("INSERT INTO users (username, password_hash, created_at) VALUES (%s, %s, %s)",
+                         (username, pw_hash, datetime.utcnow().isoformat()))
+            conn.commit()
+            return True
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            return False
+
 def verify_user(username, password):
-    conn = get_db()
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
-        c.execute("SELECT * FROM users WHERE username = %s", (username,))
+    import psycopg2.extras
+    with get_db() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+        c.execute("SELECT password_hash FROM users WHERE username = %s", (username,))
         row = c.fetchone()
-    conn.close()
-    if row and check_password_hash(row["password_hash"], password):
-        return True
-    return False
+    if not row:
+        return False
+    with timed("password_hash"):
+        return check_password_hash(row["password_hash"], password)
+
+# -------------- Discord outbox --------------
+def _embed_chars(embed):
+    n = len(embed.get("title", "")) + len(embed.get("description", ""))
+    for f in embed.get("fields", []):
+        n += len(f.get("name", "")) + len(f.get("value", ""))
+    return n
+
+def _field(value, limit=1024):
+    # Discord rechaza el mensaje entero si un campo está vacío o supera su límite
+    value = str(value) if value not in (None, "") else "—"
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+def sancion_embed(fecha, objetivo, accion, motivo, gravedad, conteo, pruebas, moderador):
+    return {
+        "title": "Registro de sanción",
+        "description": _field(f"**Acción:** {accion}", 4096),
+        "fields": [
+            {"name": "Objetivo", "value": _field(objetivo), "inline": True},
+            {"name": "Moderador", "value": _field(moderador), "inline": True},
+            # Discord muestra <t:...> en la zona horaria de quien lo lee
+            {"name": "Fecha", "value": f"<t:{int(fecha.timestamp())}:f>", "inline": True},
+            {"name": "Motivo", "value": _field(motivo), "inline": False},
+            {"name": "Gravedad", "value": _field(gravedad), "inline": True},
+            {"name": "Conteo", "value": str(conteo), "inline": True},
+            {"name": "Pruebas", "value": _field(pruebas or "No hay pruebas"), "inline": False},
+        ],
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    }
+
+def enqueue_embeds(cur, embeds):
+    import psycopg2.extras
+    # Se llama dentro de la misma transacción que el INSERT de las sanciones;
+    # el NOTIFY llega al despachador activo (en cualquier worker) al hacer commit
+    psycopg2.extras.execute_values(
+        cur, "INSERT INTO webhook_outbox (sancion_id, embed) VALUES %s",
+        [(sancion_id, psycopg2.extras.Json(embed)) for sancion_id, embed in embeds])
+    cur.execute("NOTIFY webhook_outbox")
+
+class WebhookDispatcher:
+    def __init__(self, url):
+        import requests
+        self.url = url
+        self.session = requests.Session()
+        self.pid = os.getpid()
+        self._blocked_until = 0.0
+
+    def start(self):
+        threading.Thread(target=self.run, name="webhook-outbox", daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                if self.leader_alive():
+                    time.sleep(OUTBOX_POLL)
+                    continue
+                self.lead()
+            except Exception:
+                app.logger.exception("Error en el despachador de webhooks")
+            time.sleep(5)
+
+    def leader_alive(self):
+        # Los que esperan miran pg_locks con una conexión del pool: solo el activo
+        # mantiene una conexión propia
+        with get_db() as conn, conn.cursor() as c:
+            c.execute("""
+                SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted
+                               AND classid = %s AND objid = %s AND objsubid = 2)
+            """, OUTBOX_LOCK)
+            alive = c.fetchone()[0]
+            conn.commit()
+        return alive
+
+    def lead(self):
+        # Solo un despachador activo entre todos los workers y procesos (advisory lock
+        # en una conexión propia): así el bloqueo por rate limit es global de verdad.
+        # Los demás esperan y toman el relevo si el activo desaparece.
+        import psycopg2
+        conn = psycopg2.connect(DATABASE_URL)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as c:
+                c.execute("SELECT pg_try_advisory_lock(%s, %s)", OUTBOX_LOCK)
+                if not c.fetchone()[0]:
+                    return
+                c.execute("LISTEN webhook_outbox")
+            while True:
+                delay = self.drain()
+                if select.select([conn], [], [], delay) != ([], [], []):
+                    conn.poll()
+                    conn.notifies.clear()
+        finally:
+            conn.close()
+
+    def drain(self):
+        # Devuelve cuántos segundos esperar antes de volver a mirar el outbox
+        while True:
+            blocked = self._blocked_until - time.monotonic()
+            if blocked > 0:
+                return blocked
+            if self.dispatch_once() in ("empty", "error"):
+                return OUTBOX_POLL
+
+    def _mark(self, cur, ids, result, error):
+        if result == "ok":
+            cur.execute("""
+                UPDATE webhook_outbox SET estado = 'enviado', enviado_at = now(),
+                    intentos = intentos + 1, ultimo_error = NULL
+                WHERE id = ANY(%s)
+            """, (ids,))
+        elif result != "ratelimited":
+            # "rejected" (4xx) no se reintenta; errores de red y 5xx con backoff exponencial
+            cur.execute("""
+                UPDATE webhook_outbox SET intentos = intentos + 1, ultimo_error = %s,
+                    estado = CASE WHEN %s OR intentos + 1 >= %s THEN 'fallido' ELSE 'pendiente' END,
+                    siguiente_intento = now() + make_interval(
+                        secs => LEAST(power(2, intentos + 1), 600) * (1 + random() / 4))
+                WHERE id = ANY(%s)
+            """, (error, result == "rejected", OUTBOX_MAX_ATTEMPTS, ids))
+
+    def dispatch_once(self):
+        with get_db() as conn, conn.cursor() as c:
+            c.execute("""
+                SELECT id, embed FROM webhook_outbox
+                WHERE estado = 'pendiente' AND siguiente_intento <= now()
+                ORDER BY id LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (DISCORD_MAX_EMBEDS,))
+            rows = c.fetchall()
+            if not rows:
+                conn.commit()
+                return "empty"
+
+            batch, chars = [], 0
+            for row in rows:
+                size = _embed_chars(row[1])
+                if batch and chars + size > DISCORD_MAX_EMBED_CHARS:
+                    break
+                batch.append(row)
+                chars += size
+
+            result, error = self.post([r[1] for r in batch])
+            if result == "rejected" and len(batch) > 1:
+                # Discord rechaza el mensaje entero por un solo embed malo:
+                # se reenvían de uno en uno para no perder los válidos
+                for row in batch:
+                    result, error = self.post([row[1]])
+                    if result == "ratelimited":
+                        break
+                    self._mark(c, [row[0]], result, error)
+            else:
+                self._mark(c, [r[0] for r in batch], result, error)
+            conn.commit()
+            return result
+
+    def _block(self, seconds):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def post(self, embeds):
+        import requests
+        t0 = time.perf_counter()
+        try:
+            res = self.session.post(self.url, json={"embeds": embeds}, timeout=10)
+        except requests.RequestException as e:
+            WEBHOOK_SECONDS.labels("error").observe(time.perf_counter() - t0)
+            return "error", str(e)
+        WEBHOOK_SECONDS.labels(str(res.status_code)).observe(time.perf_counter() - t0)
+
+        if res.headers.get("X-RateLimit-Remaining") == "0":
+            self._block(float(res.headers.get("X-RateLimit-Reset-After", "1")))
+        if res.status_code == 429:
+            try:
+                retry_after = float(res.json().get("retry_after"))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = float(res.headers.get("Retry-After", "5"))
+            self._block(retry_after)
+            return "ratelimited", None
+        if res.status_code >= 500:
+            return "error", f"HTTP {res.status_code}"
+        if res.status_code >= 400:
+            return "rejected", f"HTTP {res.status_code}: {res.text[:500]}"
+        return "ok", None
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    global _dispatcher
+    if not DISCORD_WEBHOOK:
+        return None
+    if _dispatcher is None or _dispatcher.pid != os.getpid():
+        with _dispatcher_lock:
+            if _dispatcher is None or _dispatcher.pid != os.getpid():
+                _dispatcher = WebhookDispatcher(DISCORD_WEBHOOK)
+                if OUTBOX_DISPATCHER == "thread":
+                    _dispatcher.start()
+    return _dispatcher
+
+# -------------- Live feed --------------
+# Un único LISTEN por worker; cada cliente SSE tiene su propia cola
+FEED_RELOAD = "reload"   # se perdió el LISTEN: los clientes deben recargar el historial
+
+class SancionesFeed:
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.pid = os.getpid()
+        self._subs = set()
+        self._recent = deque(maxlen=SSE_RECENT)
+        self._complete = True    # el buffer tiene todo lo publicado desde que se escucha
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.run, name="sanciones-feed", daemon=True).start()
+
+    def subscribe(self, last_id=None):
+        # Devuelve (cola, backlog, encontrado). Si last_id está en el buffer, backlog es lo
+        # publicado después en orden de commit; si no, todo el buffer, o None si ya se han
+        # descartado filas y no se sabe qué falta. Bajo el mismo lock que publish: cada
+        # fila va o al backlog o a la cola, nunca a los dos ni a ninguno
+        q = queue.Queue(maxsize=SSE_QUEUE_MAX)
+        with self._lock:
+            self._subs.add(q)
+            for i, row in enumerate(self._recent):
+                if row["id"] == last_id:
+                    return q, list(itertools.islice(self._recent, i + 1, None)), True
+            return q, (list(self._recent) if self._complete else None), False
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subs.discard(q)
+
+    def publish(self, row):
+        with self._lock:
+            if row is FEED_RELOAD:
+                self._recent.clear()
+                self._complete = True
+            else:
+                if len(self._recent) == self._recent.maxlen:
+                    self._complete = False
+                self._recent.append(row)
+            subs = list(self._subs)
+        for q in subs:
+            try:
+                q.put_nowait(row)
+            except queue.Full:
+                # Cliente atascado: se le cierra el stream y reanudará con Last-Event-ID
+                self.unsubscribe(q)
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(None)
+
+    def run(self):
+        connected = False
+        while True:
+            try:
+                self.listen(reconnect=connected)
+            except Exception:
+                app.logger.exception("Conexión LISTEN perdida, reconectando")
+                time.sleep(2)
+            connected = True
+
+    def listen(self, reconnect=False):
+        import psycopg2.extras
+        conn = psycopg2.connect(self.dsn)
+        try:
+            conn.autocommit = True
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+                c.execute("LISTEN sanciones")
+                if reconnect:
+                    # Lo insertado sin LISTEN no se puede ordenar: que los clientes recarguen
+                    self.publish(FEED_RELOAD)
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    payloads = [n.payload for n in conn.notifies]
+                    conn.notifies.clear()
+                    ids = []
+                    for payload in payloads:
+                        if payload == FEED_RELOAD:
+                            # Una importación: se recarga en vez de empujar cada fila
+                            if ids:
+                                self.fetch(c, ids)
+                                ids = []
+                            self.publish(FEED_RELOAD)
+                        else:
+                            ids.extend(int(i) for i in payload.split(",") if i.isdigit())
+                    if ids:
+                        self.fetch(c, ids)
+        finally:
+            conn.close()
+
+    def fetch(self, cur, ids):
+        # Exactamente las filas notificadas, en el orden en que se confirmaron
+        cur.execute(f"""
+            SELECT {', '.join(SANCION_COLUMNS)}
+            FROM unnest(%s::bigint[]) WITH ORDINALITY AS n (id, orden)
+            JOIN sanciones USING (id)
+            ORDER BY orden
+        """, (ids,))
+        for row in cur.fetchall():
+            self.publish(sancion_json(row))
+
+_feed = None
+_feed_lock = threading.Lock()
+
+def get_feed():
+    global _feed
+    if _feed is None or _feed.pid != os.getpid():
+        with _feed_lock:
+            if _feed is None or _feed.pid != os.getpid():
+                _feed = SancionesFeed(DATABASE_URL)
+                _feed.start()
+    return _feed
+
+def sse_event(row):
+    return f"id: {row['id']}\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+
+# -------------- Import / export --------------
+def export_rows(sql, params):
+    import psycopg2.extras
+    # Cursor con nombre = cursor de servidor: la memoria no depende del tamaño de la tabla
+    with get_db() as conn:
+        with conn.cursor(name="sanciones_export", cursor_factory=psycopg2.extras.DictCursor) as c:
+            c.itersize = EXPORT_CHUNK
+            c.execute(sql, params)
+            while True:
+                rows = c.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                yield [sancion_json(r) for r in rows]
+        conn.commit()
+
+def import_row(row, line):
+    # Devuelve la tupla en el orden de IMPORT_COLUMNS o lanza ValueError
+    row = {k: (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k}
+    objetivo = row.get("objetivo")
+    moderador = row.get("moderador")
+    if not objetivo:
+        raise ValueError(f"línea {line}: falta objetivo")
+    if not moderador:
+        raise ValueError(f"línea {line}: falta moderador")
+    accion = row.get("accion") or "sancionar"
+    if accion not in ACCIONES:
+        raise ValueError(f"línea {line}: acción desconocida '{accion}'")
+    gravedad = row.get("gravedad") or "Media"
+    if gravedad not in GRAVEDADES:
+        raise ValueError(f"línea {line}: gravedad desconocida '{gravedad}'")
+    try:
+        user_id = row.get("discord_id") or row.get("user_id")
+        discord_id = parse_discord_id(user_id) if user_id else None
+        fecha = parse_fecha(str(row["fecha"])) if row.get("fecha") else None
+        created_at = parse_fecha(str(row["created_at"])) if row.get("created_at") else None
+        conteo = int(row.get("conteo") or 0)
+        if not 0 <= conteo < 2**31:
+            raise ValueError(f"conteo fuera de rango ({conteo})")
+    except ValueError as e:
+        raise ValueError(f"línea {line}: {e}")
+    created_at = created_at or fecha or datetime.now(timezone.utc)
+    return (fecha or created_at, objetivo, discord_id, accion, row.get("motivo") or "",
+            gravedad, conteo, row.get("pruebas") or "", moderador, created_at)
+
+def read_import_file(f, fmt):
+    if fmt == "csv":
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            yield line, row
+    else:
+        for line, text in enumerate(f, start=1):
+            if text.strip():
+                try:
+                    row = json.loads(text)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"línea {line}: JSON no válido ({e.msg})")
+                if not isinstance(row, dict):
+                    raise ValueError(f"línea {line}: se esperaba un objeto JSON")
+                yield line, row
+
+def _copy_chunk(cur, chunk):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for values in chunk:
+        w.writerow([r"\N" if v is None else v.isoformat() if isinstance(v, datetime) else v for v in values])
+    buf.seek(0)
+    cur.copy_expert(f"COPY sanciones ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+def import_sanciones(path, fmt, dry_run=False):
+    # Todo en una transacción: si alguna fila no es válida no se importa nada
+    total = 0
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = read_import_file(f, fmt)
+        if dry_run:
+            # En modo prueba se informa de todos los errores, no solo del primero
+            errors = []
+            for line, row in rows:
+                try:
+                    import_row(row, line)
+                    total += 1
+                except ValueError as e:
+                    errors.append(str(e))
+            if errors:
+                raise ValueError(f"{len(errors)} filas no válidas:\n  " + "\n  ".join(errors[:50]))
+            return total
+        with get_db() as conn, conn.cursor() as c:
+            c.execute("SET LOCAL panel.importando = on")
+            chunk = []
+            for line, row in rows:
+                chunk.append(import_row(row, line))
+                if len(chunk) >= IMPORT_CHUNK:
+                    _copy_chunk(c, chunk)
+                    total += len(chunk)
+                    chunk = []
+                    print(f"  {total} filas...")
+            if chunk:
+                _copy_chunk(c, chunk)
+                total += len(chunk)
+            # Se entrega al confirmar, como los NOTIFY del trigger
+            c.execute("SELECT pg_notify('sanciones', %s)", (FEED_RELOAD,))
+            conn.commit()
+            # Que la primera lectura de /api/stats no tenga que agregar toda la importación
+            fold_stats(conn)
+    return total
+
+# -------------- Stats --------------
+_stats_cache = {"at": 0.0, "body": None, "etag": None}
+_stats_lock = threading.Lock()
+
+def load_stats():
+    # Lee las tablas de resumen tras volcar lo pendiente; nunca agrega sobre sanciones entera
+    with get_db() as conn, conn.cursor() as c:
+        fold_stats(conn)
+        c.execute("SELECT moderador, total FROM stats_moderador ORDER BY total DESC, moderador LIMIT 20")
+        moderadores = [{"moderador": m, "total": t} for m, t in c.fetchall()]
+        c.execute("SELECT accion, gravedad, total FROM stats_accion ORDER BY accion, gravedad")
+        acciones = [{"accion": a, "gravedad": g, "total": t} for a, g, t in c.fetchall()]
+        c.execute("""
+            SELECT dia, total FROM stats_dia
+            WHERE dia > (now() AT TIME ZONE 'UTC')::date - %s ORDER BY dia
+        """, (STATS_DIAS,))
+        dias = [{"dia": d.isoformat(), "total": t} for d, t in c.fetchall()]
+        c.execute("""
+            SELECT discord_id, objetivo, total FROM stats_objetivo
+            WHERE total > 1 ORDER BY total DESC LIMIT 10
+        """)
+        reincidentes = [{"discord_id": str(d), "objetivo": o, "total": t} for d, o, t in c.fetchall()]
+        c.execute("SELECT coalesce(sum(total), 0)::bigint FROM stats_moderador")
+        total = c.fetchone()[0]
+    return {"ok": True, "total": total, "moderadores": moderadores, "acciones": acciones,
+            "dias": dias, "reincidentes": reincidentes}
+
+def get_stats():
+    with _stats_lock:
+        if _stats_cache["body"] is None or time.monotonic() - _stats_cache["at"] > STATS_TTL:
+            body = json.dumps(load_stats(), ensure_ascii=False)
+            _stats_cache.update(at=time.monotonic(), body=body,
+                                etag=hashlib.sha1(body.encode()).hexdigest()[:16])
+        return _stats_cache["body"], _stats_cache["etag"]
 
 # ----- INICIALIZACIÓN DE LA APP -----
-try:
+def bootstrap():
+    # Migraciones + usuario administrador por defecto; se ejecuta una vez por despliegue
     init_db()
-except Exception as e:
-    print(f"Error al inicializar la base de datos (puede que ya exista): {e}")
+    admin_user = os.getenv("DEFAULT_ADMIN_USER")
+    admin_pass = os.getenv("DEFAULT_ADMIN_PASS")
 
-admin_user = os.getenv("DEFAULT_ADMIN_USER")
-admin_pass = os.getenv("DEFAULT_ADMIN_PASS")
-
-if admin_user and admin_pass:
-    print(f"Intentando crear usuario por defecto: {admin_user}")
-    created = create_user(admin_user, admin_pass)
-    if created:
-        print("Usuario por defecto CREADO CON ÉXITO.")
+    if admin_user and admin_pass:
+        print(f"Intentando crear usuario por defecto: {admin_user}")
+        created = create_user(admin_user, admin_pass)
+        if created:
+            print("Usuario por defecto CREADO CON ÉXITO.")
+        else:
+            print("Usuario por defecto ya existía, no se ha creado.")
     else:
-        print("Usuario por defecto ya existía, no se ha creado.")
-else:
-    print("No se encontraron variables DEFAULT_ADMIN_USER y DEFAULT_ADMIN_PASS, no se crea usuario.")
+        print("No se encontraron variables DEFAULT_ADMIN_USER y DEFAULT_ADMIN_PASS, no se crea usuario.")
 # ----- FIN DEL BLOQUE DE INICIALIZACIÓN -----
 
 
 # -------------- Routes --------------
+@app.before_request
+def start_timing():
+    g.t0 = time.perf_counter()
+    g.timings = {}
+
+@app.before_request
+def ensure_dispatcher():
+    # Arranca el despachador del outbox una vez por worker (tras el fork)
+    get_dispatcher()
+
+@app.after_request
+def record_request(response):
+    if "t0" not in g:
+        return response
+    total = time.perf_counter() - g.t0
+    route = request.url_rule.rule if request.url_rule else "sin_ruta"
+    REQUEST_SECONDS.labels(route, request.method, response.status_code).observe(total)
+    timings = g.timings
+    if response.is_streamed:
+        # El cuerpo se genera después (con stream_with_context, así que sus fases siguen
+        # sumando en g.timings): se publican con la ruta al cerrar la respuesta
+        response.call_on_close(lambda: observe_phases(route, timings))
+    else:
+        observe_phases(route, timings)
+    # En las respuestas en streaming esto mide hasta la cabecera, no el cuerpo
+    response.headers["Server-Timing"] = ", ".join(
+        [f"total;dur={total * 1000:.1f}"] + [f"{p};dur={s * 1000:.1f}" for p, s in g.timings.items()])
+    if SLOW_REQUEST_MS and total * 1000 >= SLOW_REQUEST_MS:
+        app.logger.warning("Petición lenta: %s %s -> %s en %.0f ms (%s)", request.method, request.path,
+                           response.status_code, total * 1000,
+                           ", ".join(f"{p} {s * 1000:.0f} ms" for p, s in g.timings.items()) or "sin fases")
+    return response
+
 @app.route("/")
 def index():
     if session.get("user"):
@@ -132,83 +1314,440 @@ def panel():
         return redirect(url_for("index"))
     return render_template("panel.html", user=session.get("user"))
 
+def json_text(value, campo):
+    # Cadenas y números (como texto); un objeto o una lista no cabe en una columna TEXT
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f"Campo '{campo}' no válido")
+
+def sancion_from_json(data, moderador):
+    # Lanza ValueError con un mensaje para el usuario si algún campo no es válido
+    try:
+        fecha = parse_fecha(data["fecha"]) if data.get("fecha") else datetime.now(timezone.utc)
+    except (ValueError, TypeError):
+        raise ValueError("Fecha no válida")
+    user_id = str(data.get("user_id") or "").strip() # La ID de Discord nueva
+    try:
+        conteo = int(data.get("conteo") or 0)
+    except (ValueError, TypeError):
+        raise ValueError("Conteo no válido")
+    if not 0 <= conteo < 2**31:
+        raise ValueError("Conteo fuera de rango")
+    accion = data.get("accion") or "sancionar"
+    if accion not in ACCIONES:
+        raise ValueError(f"Acción desconocida '{accion}'")
+    gravedad = data.get("gravedad") or "Media"
+    if gravedad not in GRAVEDADES:
+        raise ValueError(f"Gravedad desconocida '{gravedad}'")
+    return {
+        "fecha": fecha,
+        "objetivo": json_text(data.get("objetivo"), "objetivo") or "—",
+        "discord_id": parse_discord_id(user_id) if user_id else None,
+        "accion": accion,
+        "motivo": json_text(data.get("motivo", "—"), "motivo"),
+        "gravedad": gravedad,
+        "conteo": conteo,
+        "pruebas": json_text(data.get("pruebas", ""), "pruebas"),
+        "moderador": moderador,
+    }
+
+def insert_sanciones(conn, items, dispatcher):
+    import psycopg2.extras
+    # Inserta todo en una transacción y rellena "id" y "conteo" en cada item
+    with conn.cursor() as c:
+        discord_ids = sorted({it["discord_id"] for it in items if it["discord_id"] is not None})
+        if discord_ids:
+            # El conteo sale del índice (discord_id, id); los locks (en orden, sin deadlocks)
+            # evitan carreras entre envíos simultáneos al mismo usuario
+            c.execute("""
+                SELECT pg_advisory_xact_lock(d) FROM (SELECT unnest(%s::bigint[]) AS d ORDER BY 1) s
+            """, (discord_ids,))
+            c.execute("""
+                SELECT discord_id, count(*) FROM sanciones
+                WHERE discord_id = ANY(%s) GROUP BY discord_id
+            """, (discord_ids,))
+            counts = dict(c.fetchall())
+            for it in items:
+                if it["discord_id"] is not None:
+                    counts[it["discord_id"]] = counts.get(it["discord_id"], 0) + 1
+                    it["conteo"] = counts[it["discord_id"]]
+
+        cols = ("fecha", "objetivo", "discord_id", "accion", "motivo", "gravedad", "conteo", "pruebas", "moderador")
+        rows = psycopg2.extras.execute_values(
+            c, f"INSERT INTO sanciones ({', '.join(cols)}) VALUES %s RETURNING id",
+            [tuple(it[col] for col in cols) for it in items], page_size=len(items), fetch=True)
+        for it, row in zip(items, rows):
+            it["id"] = row[0]
+
+        if dispatcher:
+            embeds = []
+            for it in items:
+                objetivo_discord_ping = it["objetivo"]
+                if it["discord_id"] is not None:
+                    objetivo_discord_ping = f"{it['objetivo']} (<@{it['discord_id']}>)"
+                embeds.append((it["id"], sancion_embed(
+                    it["fecha"], objetivo_discord_ping, it["accion"], it["motivo"],
+                    it["gravedad"], it["conteo"], it["pruebas"], it["moderador"])))
+            enqueue_embeds(c, embeds)
+    conn.commit()
+
 @app.route("/send_sancion", methods=["POST"])
 def send_sancion():
     if not session.get("user"):
         return jsonify({"ok": False, "msg": "No autenticado"}), 401
 
     data = request.json
-    
-    fecha = data.get("fecha") or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-    objetivo_name = data.get("objetivo", "—")
-    user_id = data.get("user_id", "").strip() # La ID de Discord nueva
-    accion = data.get("accion", "sancionar")
-    motivo = data.get("motivo", "—")
-    gravedad = data.get("gravedad", "Media")
-    conteo = int(data.get("conteo") or 0)
-    pruebas = data.get("pruebas", "")
-    moderador = session.get("user")
-
-    objetivo_final_db = objetivo_name
-    if user_id:
-        objetivo_final_db = f"{objetivo_name} (ID: {user_id})"
-
-    objetivo_discord_ping = objetivo_name
-    if user_id:
-        objetivo_discord_ping = f"{objetivo_name} (<@{user_id}>)"
-
-    conn = get_db()
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "msg": "Se esperaba un objeto JSON"}), 400
     try:
-        with conn.cursor() as c:
-            c.execute("""
-                INSERT INTO sanciones (fecha, objetivo, accion, motivo, gravedad, conteo, pruebas, moderador, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (fecha, objetivo_final_db, accion, motivo, gravedad, conteo, pruebas, moderador, datetime.utcnow().isoformat()))
-        conn.commit()
-    finally:
-        conn.close()
+        item = sancion_from_json(data, session.get("user"))
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": str(e)}), 400
 
-    if not DISCORD_WEBHOOK:
-        return jsonify({"ok": False, "msg": "Webhook no configurado"}), 500
+    dispatcher = get_dispatcher()
+    with get_db() as conn:
+        insert_sanciones(conn, [item], dispatcher)
 
-    embed = {
-        "title": "Registro de sanción",
-        "description": f"**Acción:** {accion}",
-        "fields": [
-            {"name": "Objetivo", "value": objetivo_discord_ping, "inline": True}, 
-            {"name": "Moderador", "value": moderador, "inline": True},
-            {"name": "Fecha", "value": fecha, "inline": True},
-            {"name": "Motivo", "value": motivo, "inline": False},
-            {"name": "Gravedad", "value": gravedad, "inline": True},
-            {"name": "Conteo", "value": str(conteo), "inline": True},
-            {"name": "Pruebas", "value": pruebas or "No hay pruebas", "inline": False},
-        ],
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    payload = {"embeds": [embed]}
+    if not dispatcher:
+        return jsonify({"ok": True, "id": item["id"], "conteo": item["conteo"], "webhook": "no_configurado",
+                        "msg": "Sanción guardada (webhook no configurado)"})
+    return jsonify({"ok": True, "id": item["id"], "conteo": item["conteo"], "webhook": "pendiente",
+                    "msg": "Sanción guardada, aviso a Discord en cola"})
 
-    try:
-        res = requests.post(DISCORD_WEBHOOK, json=payload, timeout=10)
-        res.raise_for_status()
-    except Exception as e:
-        return jsonify({"ok": False, "msg": f"Error al enviar webhook: {e}"}), 500
+@app.route("/send_sanciones", methods=["POST"])
+def send_sanciones():
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"ok": False, "msg": "Se esperaba un objeto JSON"}), 400
+    objetivos = data.get("objetivos")
+    if not isinstance(objetivos, list) or not objetivos:
+        return jsonify({"ok": False, "msg": "Falta la lista de objetivos"}), 400
+    if len(objetivos) > BATCH_MAX:
+        return jsonify({"ok": False, "msg": f"Máximo {BATCH_MAX} objetivos por envío"}), 400
+
+    # Campos comunes (accion, motivo, gravedad, pruebas, fecha) + los de cada objetivo
+    common = {k: v for k, v in data.items() if k != "objetivos"}
+    results, items = [None] * len(objetivos), []
+    for i, target in enumerate(objetivos):
+        try:
+            if not isinstance(target, dict):
+                raise ValueError("Objetivo no válido")
+            item = sancion_from_json({**common, **target}, session.get("user"))
+        except ValueError as e:
+            results[i] = {"index": i, "ok": False, "msg": str(e)}
+            continue
+        item["index"] = i
+        items.append(item)
+
+    if not items:
+        return jsonify({"ok": False, "msg": "Ningún objetivo válido", "results": results}), 400
+
+    dispatcher = get_dispatcher()
+    with get_db() as conn:
+        insert_sanciones(conn, items, dispatcher)
+
+    for it in items:
+        results[it["index"]] = {"index": it["index"], "ok": True, "id": it["id"], "conteo": it["conteo"]}
+    return jsonify({
+        "ok": True,
+        "saved": len(items),
+        "failed": len(results) - len(items),
+        "webhook": "pendiente" if dispatcher else "no_configurado",
+        "results": results,
+        "msg": f"{len(items)} sanciones guardadas",
+    })
+
+@app.route("/api/sanciones/<int:sancion_id>/webhook")
+def api_sancion_webhook(sancion_id):
+    import psycopg2.extras
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    with get_db() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+        c.execute("""
+            SELECT estado, intentos, ultimo_error, enviado_at FROM webhook_outbox
+            WHERE sancion_id = %s ORDER BY id DESC LIMIT 1
+        """, (sancion_id,))
+        row = c.fetchone()
+    if not row:
+        return jsonify({"ok": True, "webhook": "no_configurado"})
+    return jsonify({"ok": True, "webhook": row["estado"], "intentos": row["intentos"],
+                    "error": row["ultimo_error"],
+                    "enviado_at": row["enviado_at"].isoformat() if row["enviado_at"] else None})
+
+def parse_discord_id(value):
+    value = str(value).strip()
+    if not re.fullmatch(r"\d{1,19}", value) or int(value) >= 2**63:
+        raise ValueError("La ID de Discord debe ser numérica")
+    return int(value)
+
+def parse_fecha(value, fin=False):
+    # Sin zona horaria se asume UTC; "hasta" con solo fecha (YYYY-MM-DD) incluye el día entero
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    if fin and len(value) == 10:
+        dt += timedelta(days=1)
+    return dt
+
+def sanciones_filters(args):
+    where, params = [], []
+    for col in ("moderador", "accion", "gravedad"):
+        if args.get(col):
+            where.append(f"{col} = %s")
+            params.append(args[col])
+    if args.get("discord_id"):
+        where.append("discord_id = %s")
+        params.append(parse_discord_id(args["discord_id"]))
+    if args.get("desde"):
+        where.append("created_at >= %s")
+        params.append(parse_fecha(args["desde"]))
+    if args.get("hasta"):
+        where.append("created_at < %s")
+        params.append(parse_fecha(args["hasta"], fin=True))
+    return where, params
+
+def sancion_json(row):
+    d = dict(row)
+    for k, v in d.items():
+        if isinstance(v, datetime):
+            d[k] = v.isoformat()
+    # Los snowflakes de Discord no caben en un Number de JavaScript
+    if d.get("discord_id") is not None:
+        d["discord_id"] = str(d["discord_id"])
+    return d
+
+def sanciones_columns(args):
+    if not args.get("fields"):
+        return list(SANCION_COLUMNS)
+    cols = [f.strip() for f in args["fields"].split(",") if f.strip()]
+    unknown = [f for f in cols if f not in SANCION_COLUMNS]
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+    # id siempre hace falta para paginar
+    return ["id"] + [f for f in cols if f != "id"]
+
+def page_sanciones(args, where=(), params=()):
+    import psycopg2.extras
+    limit = int(args.get("limit", HISTORIAL_LIMIT))
+    if limit < 1:
+        raise ValueError("limit tiene que ser mayor que 0")
+    limit = min(limit, HISTORIAL_LIMIT_MAX)
+    before_id = int(args["before_id"]) if args.get("before_id") else None
+    after_id = int(args["after_id"]) if args.get("after_id") else None
+    if before_id is not None and after_id is not None:
+        raise ValueError("before_id y after_id no se pueden combinar")
+    filters, filter_params = sanciones_filters(args)
+    where = list(where) + filters
+    params = list(params) + filter_params
+    cols = sanciones_columns(args)
+
+    # Paginación por cursor sobre la PK: cada página es un único range scan del índice
+    if after_id is not None:
+        where.append("id > %s")
+        params.append(after_id)
+        order = "ASC"
+    else:
+        if before_id is not None:
+            where.append("id < %s")
+            params.append(before_id)
+        order = "DESC"
+    sql = f"SELECT {', '.join(cols)} FROM sanciones"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY id {order} LIMIT %s"
+    params.append(limit + 1)
 
-    return jsonify({"ok": True, "msg": "Sanción enviada y guardada"})
+    with get_db() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    has_more = len(rows) > limit
+    data = [sancion_json(r) for r in rows[:limit]]
+    if order == "ASC":
+        data.reverse()
+    return {
+        "ok": True,
+        "data": data,
+        "has_more": has_more,
+        "next_before_id": data[-1]["id"] if data else before_id,
+        "next_after_id": data[0]["id"] if data else after_id,
+    }
 
 @app.route("/api/sanciones")
 def api_sanciones():
     if not session.get("user"):
         return jsonify({"ok": False, "msg": "No autenticado"}), 401
-    conn = get_db()
-    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
-        c.execute("SELECT * FROM sanciones ORDER BY id DESC")
-        rows = c.fetchall()
-    conn.close()
-    data = [dict(r) for r in rows]
-    return jsonify({"ok": True, "data": data})
+    try:
+        return jsonify(page_sanciones(request.args))
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": f"Parámetros no válidos: {e}"}), 400
+
+@app.route("/api/objetivo/<int:user_id>")
+def api_objetivo(user_id):
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    if user_id >= 2**63:
+        return jsonify({"ok": False, "msg": "ID de Discord no válida"}), 400
+    try:
+        page = page_sanciones(request.args, ["discord_id = %s"], [user_id])
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": f"Parámetros no válidos: {e}"}), 400
+    with get_db() as conn, conn.cursor() as c:
+        c.execute("SELECT count(*) FROM sanciones WHERE discord_id = %s", (user_id,))
+        page["total"] = c.fetchone()[0]
+    page["discord_id"] = str(user_id)
+    return jsonify(page)
+
+@app.route("/api/sanciones/export")
+def api_sanciones_export():
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"ok": False, "msg": "Formato no soportado (csv o ndjson)"}), 400
+    try:
+        where, params = sanciones_filters(request.args)
+        cols = sanciones_columns(request.args)
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": f"Parámetros no válidos: {e}"}), 400
+    sql = f"SELECT {', '.join(cols)} FROM sanciones"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id"
+
+    def generate():
+        if fmt == "csv":
+            buf = io.StringIO()
+            w = csv.DictWriter(buf, fieldnames=cols)
+            w.writeheader()
+            yield buf.getvalue()
+        for rows in export_rows(sql, params):
+            if fmt == "csv":
+                buf = io.StringIO()
+                csv.DictWriter(buf, fieldnames=cols).writerows(rows)
+                yield buf.getvalue()
+            else:
+                yield "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=sanciones.{fmt}"})
+
+@app.route("/api/sanciones/stream")
+def api_sanciones_stream():
+    import psycopg2.extras
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    # EventSource reenvía Last-Event-ID al reconectar; la primera vez el panel pasa ?last_id=
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("last_id")
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({"ok": False, "msg": "Last-Event-ID no válido"}), 400
+
+    feed = get_feed()
+    q, backlog, found = feed.subscribe(last_id)
+    if last_id is None:
+        backlog = []
+    try:
+        if last_id is not None and not found and backlog is not None:
+            # last_id se confirmó antes de que este worker empezara a escuchar (el feed
+            # arranca con el worker): todo lo confirmado después está en el buffer, y lo
+            # anterior con id mayor se lee de la tabla. Lo único que no se cubre es una fila
+            # con id menor confirmada tras la página del cliente pero antes de arrancar el feed
+            with get_db() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as c:
+                c.execute(f"""
+                    SELECT {', '.join(SANCION_COLUMNS)} FROM sanciones
+                    WHERE id > %s ORDER BY id LIMIT %s
+                """, (last_id, SSE_BACKLOG + 1))
+                table = [sancion_json(r) for r in c.fetchall()]
+            ids = {row["id"] for row in table}
+            backlog = table + [row for row in backlog if row["id"] not in ids]
+    except Exception:
+        feed.unsubscribe(q)
+        raise
+    # Si falta demasiado (o no se sabe qué falta) el panel recarga el historial
+    reload = backlog is None or len(backlog) > SSE_BACKLOG
+
+    def stream():
+        # Lo leído de la tabla puede llegar también por la cola: se deduplica por id
+        seen = {row["id"] for row in backlog or ()}
+        try:
+            yield "retry: 3000\n\n"
+            if reload:
+                yield "event: reload\ndata: {}\n\n"
+                return
+            for row in backlog or ():
+                yield sse_event(row)
+            while True:
+                try:
+                    row = q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if row is None:
+                    return
+                if row is FEED_RELOAD:
+                    yield "event: reload\ndata: {}\n\n"
+                    return
+                if row["id"] in seen:
+                    continue
+                yield sse_event(row)
+        finally:
+            feed.unsubscribe(q)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/stats")
+def api_stats():
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    body, etag = get_stats()
+    res = Response(body, mimetype="application/json")
+    res.set_etag(etag)
+    res.headers["Cache-Control"] = "private, no-cache"
+    return res.make_conditional(request)
+
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("No autorizado\n", status=401, mimetype="text/plain")
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    return jsonify({"ok": False, "msg": "Base de datos saturada, inténtalo de nuevo"}), 503
+
+@app.route("/api/pool")
+def api_pool():
+    if not session.get("user"):
+        return jsonify({"ok": False, "msg": "No autenticado"}), 401
+    return jsonify({"ok": True, "data": get_pool().stats()})
 
 if __name__ == "__main__":
     import sys
+    if len(sys.argv) >= 2 and sys.argv[1] in ("migrate", "bootstrap"):
+        try:
+            if sys.argv[1] == "migrate":
+                init_db()
+            else:
+                bootstrap()
+        except Exception as e:
+            print(f"Error al migrar la base de datos: {e}")
+            sys.exit(1)
+        print(f"Esquema en versión {SCHEMA_VERSION}.")
+        sys.exit(0)
+
     if len(sys.argv) >= 2 and sys.argv[1] == "create_user":
         if len(sys.argv) != 4:
             print("Uso: python app.py create_user <username> <password>")
@@ -221,6 +1760,47 @@ if __name__ == "__main__":
         else:
             print("Error: usuario ya existe.")
         sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "import":
+        args = sys.argv[2:]
+        dry_run = "--dry-run" in args
+        args = [a for a in args if a != "--dry-run"]
+        if len(args) != 1:
+            print("Uso: python app.py import <fichero.csv|fichero.ndjson> [--dry-run]")
+            sys.exit(1)
+        path = args[0]
+        fmt = "csv" if path.lower().endswith(".csv") else "ndjson"
+        import psycopg2
+        try:
+            n = import_sanciones(path, fmt, dry_run=dry_run)
+        except (ValueError, OSError) as e:
+            print(f"Error: {e}. No se ha importado nada.")
+            sys.exit(1)
+        except psycopg2.Error as e:
+            print(f"Error de base de datos: {str(e).strip()}. No se ha importado nada.")
+            sys.exit(1)
+        if dry_run:
+            print(f"Validación correcta: {n} filas listas para importar (no se ha escrito nada).")
+        else:
+            print(f"{n} sanciones importadas.")
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "rebuild_stats":
+        with get_db() as conn:
+            rebuild_stats(conn)
+        print("Estadísticas recalculadas.")
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1] == "dispatch":
+        # Despachador dedicado (OUTBOX_DISPATCHER=off en los workers web); si no, compite
+        # por el mismo advisory lock y solo uno de todos envía a la vez
+        if not DISCORD_WEBHOOK:
+            print("Error: DISCORD_WEBHOOK no configurado.")
+            sys.exit(1)
+        print("Despachando webhooks pendientes (Ctrl+C para salir)...")
+        WebhookDispatcher(DISCORD_WEBHOOK).run()
     
-    print("Para producción, usa 'gunicorn app:app'")
+    print("Para producción, usa 'python app.py bootstrap' una vez y después 'gunicorn app:app'")
+    if check_schema() is False:
+        sys.exit(1)
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,230 @@
+# Benchmark offline del panel: Postgres local + webhook de Discord falso + gunicorn.
+#
+#   python bench/run.py --database-url postgresql://localhost/panel_bench --rows 200000
+#
+# Usa SIEMPRE una base de datos de pruebas: se migra y se rellena con sanciones
+# sintéticas. Nunca se contacta con Discord (DISCORD_WEBHOOK apunta al servidor falso).
+# Informa p50/p99 y throughput por endpoint y el desglose de /metrics por fase.
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_discord import StubDiscord  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_USER = "bench"
+BENCH_PASS = "bench"
+USER_IDS_BASE = 300000000000000000
+MODERADORES = [f"mod{i}" for i in range(10)]
+ACCIONES = ("sancionar", "desancionar", "advertir")
+GRAVEDADES = ("Baja", "Media", "Alta", "Crítica")
+
+
+def seed(database_url, rows, users):
+    conn = psycopg2.connect(database_url)
+    with conn.cursor() as c:
+        c.execute("SELECT count(*) FROM sanciones")
+        have = c.fetchone()[0]
+        if have >= rows:
+            print(f"Seed: ya hay {have} sanciones, no se añade nada")
+            return
+        print(f"Seed: insertando {rows - have} sanciones sintéticas...")
+        now = datetime.now(timezone.utc)
+        rnd = random.Random(42)
+        done = have
+        while done < rows:
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            for _ in range(min(20000, rows - done)):
+                created = now - timedelta(seconds=rnd.randint(0, 365 * 86400))
+                uid = USER_IDS_BASE + rnd.randint(0, users - 1)
+                w.writerow([created.isoformat(), f"user{uid % 100000}", uid, rnd.choice(ACCIONES),
+                            "Motivo de prueba " * rnd.randint(1, 5), rnd.choice(GRAVEDADES), 1, "",
+                            rnd.choice(MODERADORES), created.isoformat()])
+                done += 1
+            buf.seek(0)
+            c.copy_expert("""
+                COPY sanciones (fecha, objetivo, discord_id, accion, motivo, gravedad, conteo, pruebas, moderador, created_at)
+                FROM STDIN WITH (FORMAT csv)
+            """, buf)
+            conn.commit()
+        c.execute("ANALYZE sanciones")
+    conn.commit()
+    conn.close()
+
+
+def wait_ready(base, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gunicorn terminó antes de arrancar")
+        try:
+            requests.get(base + "/", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn no respondió a tiempo")
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def run_scenario(name, fn, cookies, total, concurrency):
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "s"):
+            local.s = requests.Session()
+            local.s.cookies.update(cookies)
+        t0 = time.perf_counter()
+        try:
+            ok = fn(local.s, i).status_code < 400
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - t0, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as ex:
+        results = list(ex.map(one, range(total)))
+    elapsed = time.perf_counter() - t0
+    lat = sorted(r[0] * 1000 for r in results)
+    return {
+        "escenario": name,
+        "n": total,
+        "errores": sum(1 for r in results if not r[1]),
+        "p50_ms": round(percentile(lat, 50), 2),
+        "p99_ms": round(percentile(lat, 99), 2),
+        "media_ms": round(sum(lat) / len(lat), 2),
+        "req_s": round(total / elapsed, 1),
+    }
+
+
+def scenarios(base, rows, users, batch):
+    rnd = random.Random(7)
+
+    def user_id():
+        return USER_IDS_BASE + rnd.randint(0, users - 1)
+
+    def sancion(i):
+        return {"objetivo": f"bench{i}", "user_id": str(user_id()), "accion": "advertir",
+                "motivo": "benchmark", "gravedad": "Baja"}
+
+    return [
+        ("POST /login", lambda s, i: s.post(base + "/login", data={"username": BENCH_USER, "password": BENCH_PASS},
+                                            allow_redirects=False)),
+        ("GET /api/sanciones", lambda s, i: s.get(base + "/api/sanciones", params={"limit": 20})),
+        ("GET /api/sanciones?before_id", lambda s, i: s.get(base + "/api/sanciones",
+                                                            params={"limit": 20, "before_id": rnd.randint(1, rows)})),
+        ("GET /api/sanciones?moderador", lambda s, i: s.get(base + "/api/sanciones",
+                                                            params={"limit": 20, "moderador": rnd.choice(MODERADORES)})),
+        ("GET /api/objetivo/<id>", lambda s, i: s.get(f"{base}/api/objetivo/{user_id()}", params={"limit": 20})),
+        ("GET /api/stats", lambda s, i: s.get(base + "/api/stats")),
+        ("POST /send_sancion", lambda s, i: s.post(base + "/send_sancion", json=sancion(i))),
+        (f"POST /send_sanciones ({batch})", lambda s, i: s.post(base + "/send_sanciones", json={
+            "accion": "sancionar", "motivo": "raid (benchmark)", "gravedad": "Alta",
+            "objetivos": [{"objetivo": f"raid{i}-{j}", "user_id": str(user_id())} for j in range(batch)]})),
+    ]
+
+
+METRIC_RE = re.compile(r'^panel_request_phase_seconds_(sum|count)\{phase="([^"]+)",route="([^"]+)"\} (\S+)$')
+
+
+def phase_breakdown(base):
+    text = requests.get(base + "/metrics", timeout=5).text
+    acc = {}
+    for line in text.splitlines():
+        m = METRIC_RE.match(line)
+        if m:
+            kind, phase, route, value = m.groups()
+            acc.setdefault((route, phase), {})[kind] = float(value)
+    return {k: v["sum"] / v["count"] * 1000 for k, v in acc.items() if v.get("count")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del panel de sanciones")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Postgres de PRUEBAS (o BENCH_DATABASE_URL)")
+    parser.add_argument("--rows", type=int, default=100000, help="tamaño del historial sintético")
+    parser.add_argument("--users", type=int, default=5000, help="usuarios de Discord distintos en el seed")
+    parser.add_argument("--requests", type=int, default=300, help="peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2, help="workers de gunicorn")
+    parser.add_argument("--port", type=int, default=5077)
+    parser.add_argument("--batch", type=int, default=25, help="objetivos por /send_sanciones")
+    parser.add_argument("--webhook-latency-ms", type=float, default=0)
+    parser.add_argument("--json", help="guarda los resultados en este fichero")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("hace falta --database-url o BENCH_DATABASE_URL (¡una base de datos de pruebas!)")
+
+    stub = StubDiscord(("127.0.0.1", 0), latency_ms=args.webhook_latency_ms).start()
+    env = dict(os.environ, DATABASE_URL=args.database_url, DISCORD_WEBHOOK=stub.url,
+               APP_SECRET="bench", DEFAULT_ADMIN_USER=BENCH_USER, DEFAULT_ADMIN_PASS=BENCH_PASS,
+               WEB_CONCURRENCY=str(args.workers), SLOW_REQUEST_MS="0")
+    env.pop("METRICS_TOKEN", None)
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    subprocess.run([sys.executable, "app.py", "bootstrap"], cwd=ROOT, env=env, check=True)
+    seed(args.database_url, args.rows, args.users)
+
+    base = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:app", "-b", f"127.0.0.1:{args.port}"],
+                            cwd=ROOT, env=env)
+    try:
+        wait_ready(base, proc)
+        s = requests.Session()
+        s.post(base + "/login", data={"username": BENCH_USER, "password": BENCH_PASS}, allow_redirects=False)
+        if "session" not in s.cookies:
+            raise RuntimeError("no se pudo iniciar sesión con el usuario de benchmark")
+
+        results = []
+        print(f"\n{'escenario':34} {'n':>6} {'err':>5} {'p50 ms':>9} {'p99 ms':>9} {'media ms':>9} {'req/s':>8}")
+        for name, fn in scenarios(base, args.rows, args.users, args.batch):
+            r = run_scenario(name, fn, s.cookies, args.requests, args.concurrency)
+            results.append(r)
+            print(f"{r['escenario']:34} {r['n']:>6} {r['errores']:>5} {r['p50_ms']:>9} {r['p99_ms']:>9} "
+                  f"{r['media_ms']:>9} {r['req_s']:>8}")
+
+        print("\nTiempo medio por fase y ruta (de /metrics):")
+        phases = phase_breakdown(base)
+        for (route, phase), ms in sorted(phases.items()):
+            print(f"  {route:28} {phase:14} {ms:9.2f} ms")
+
+        # Deja que el despachador vacíe el outbox para medir los mensajes enviados
+        expected = args.requests * (1 + args.batch)
+        deadline = time.monotonic() + 30
+        while stub.embeds < expected and time.monotonic() < deadline:
+            time.sleep(0.5)
+        print(f"\nWebhook falso: {stub.embeds}/{expected} embeds en {stub.messages} mensajes")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results,
+                           "phases_ms": {f"{r} {p}": v for (r, p), v in phases.items()},
+                           "webhook": {"messages": stub.messages, "embeds": stub.embeds}}, f, indent=2)
+    finally:
+        proc.terminate()
+        proc.wait(10)
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
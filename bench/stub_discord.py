@@ -0,0 +1,78 @@
+# Servidor falso del webhook de Discord para los benchmarks: responde 204 con las
+# cabeceras de rate limit de Discord y, opcionalmente, añade latencia o 429.
+#
+#   python bench/stub_discord.py --port 8765 --latency-ms 150
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubDiscord(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, latency_ms=0, ratelimit_ratio=0.0):
+        super().__init__(addr, StubHandler)
+        self.latency = latency_ms / 1000
+        self.ratelimit_ratio = ratelimit_ratio
+        self.lock = threading.Lock()
+        self.messages = 0
+        self.embeds = 0
+        self.ratelimited = 0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/webhook"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-discord", daemon=True).start()
+        return self
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        srv = self.server
+        if srv.latency:
+            time.sleep(srv.latency)
+        if srv.ratelimit_ratio and random.random() < srv.ratelimit_ratio:
+            with srv.lock:
+                srv.ratelimited += 1
+            payload = json.dumps({"message": "You are being rate limited.", "retry_after": 0.5, "global": False}).encode()
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        embeds = len(json.loads(body or b"{}").get("embeds", []))
+        with srv.lock:
+            srv.messages += 1
+            srv.embeds += embeds
+        self.send_response(204)
+        self.send_header("X-RateLimit-Limit", "5")
+        self.send_header("X-RateLimit-Remaining", "4")
+        self.send_header("X-RateLimit-Reset-After", "0.4")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webhook de Discord falso para pruebas locales")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--ratelimit-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+    srv = StubDiscord((args.host, args.port), args.latency_ms, args.ratelimit_ratio)
+    print(f"Webhook falso escuchando en {srv.url}")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# El stream SSE (/api/sanciones/stream) mantiene la conexión abierta: con workers
+# síncronos cada pestaña ocuparía un worker entero, así que por defecto usamos gevent.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+# /metrics agrega las métricas de todos los workers a través de este directorio;
+# tiene que estar definido antes de que los workers importen prometheus_client
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR",
+                                    os.path.join(tempfile.gettempdir(), "panel-sanciones-metrics"))
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    if worker_class == "gevent":
+        # psycopg2 es una extensión en C: sin esto bloquearía todo el worker en cada consulta
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+    # Las migraciones se aplican con `python app.py migrate`; aquí solo se comprueba la versión.
+    # Salir con 4 (APP_LOAD_ERROR) para todo el servidor: solo si el esquema está
+    # desactualizado seguro, nunca porque la base de datos no responda en ese momento
+    from app import check_schema, get_feed
+    if check_schema() is False:
+        sys.exit(4)
+
+    # El LISTEN del feed en vivo arranca con el worker y no con el primer cliente SSE:
+    # así el buffer de reanudación tiene todo lo confirmado desde el arranque
+    get_feed()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -12,37 +12,53 @@ async function sendSancion(e) {
   msgDiv.innerText = "Enviando...";
 
   // Recoge todos los datos, INCLUYENDO EL NUEVO USER_ID
+  const fechaLocal = document.getElementById("fecha").value;
+  const multi = document.getElementById("multi").checked;
   const payload = {
-    fecha: document.getElementById("fecha").value || null,
-    objetivo: document.getElementById("objetivo").value,
-    user_id: document.getElementById("user_id").value, // <-- ¡¡CAMPO NUEVO!!
+    // datetime-local no lleva zona: se envía en UTC con toISOString()
+    fecha: fechaLocal ? new Date(fechaLocal).toISOString() : null,
     accion: document.getElementById("accion").value,
     motivo: document.getElementById("motivo").value,
     gravedad: document.getElementById("gravedad").value,
     conteo: document.getElementById("conteo").value,
     pruebas: document.getElementById("pruebas").value
   };
+  if (multi) {
+    payload.objetivos = parseObjetivos(document.getElementById("objetivos").value);
+  } else {
+    payload.objetivo = document.getElementById("objetivo").value;
+    payload.user_id = document.getElementById("user_id").value;
+  }
 
   try {
-    const res = await fetch("/send_sancion", {
+    const res = await fetch(multi ? "/send_sanciones" : "/send_sancion", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify(payload)
     });
     const data = await res.json();
     
-    if (data.ok) {
+    if (data.ok && multi) {
+      const errores = data.results.filter(r => !r.ok)
+        .map(r => `${payload.objetivos[r.index].objetivo}: ${r.msg}`);
+      msgDiv.className = errores.length ? "msg-error" : "msg-success";
+      msgDiv.innerText = `✅ ${data.msg}` + (errores.length ? `\n❌ ${errores.join("\n❌ ")}` : "");
+      form.reset();
+      toggleMulti();
+      if (!feed) loadHistorial();
+    } else if (data.ok) {
       msgDiv.className = "msg-success";
-      msgDiv.innerText = "✅ Sanción enviada y guardada";
+      msgDiv.innerText = "✅ " + data.msg;
       form.reset(); // <-- MEJORA PROFESIONAL: Limpia todo el formulario
-      loadHistorial();
+      if (!feed) loadHistorial(); // con el feed en vivo la entrada llega sola
+      if (data.webhook === "pendiente") checkWebhook(data.id, msgDiv);
     } else {
       msgDiv.className = "msg-error";
       msgDiv.innerText = "❌ Error: " + (data.msg || "desconocido");
     }
   } catch (err) {
     msgDiv.className = "msg-error";
-    msgDiv.innerText = "❌ Error de red: "S" + err.message;
+    msgDiv.innerText = "❌ Error de red: " + err.message;
   }
 
   // --- MEJORA PROFESIONAL: Reactivar botón ---
@@ -58,42 +74,173 @@ async function sendSancion(e) {
   return false;
 }
 
-async function loadHistorial() {
+// Modo varios objetivos: una línea por usuario, "nombre ID" (la ID al final es opcional)
+function parseObjetivos(text) {
+  return text.split("\n").map(l => l.trim()).filter(Boolean).map(line => {
+    const m = line.match(/^(.*?)[\s,;]+(\d{15,20})$/);
+    if (m) return { objetivo: m[1], user_id: m[2] };
+    if (/^\d{15,20}$/.test(line)) return { objetivo: line, user_id: line };
+    return { objetivo: line, user_id: "" };
+  });
+}
+
+function toggleMulti() {
+  const multi = document.getElementById("multi").checked;
+  document.getElementById("single-target").hidden = multi;
+  document.getElementById("multi-target").hidden = !multi;
+  document.getElementById("objetivo").required = !multi;
+  document.getElementById("objetivos").required = multi;
+}
+
+// El aviso a Discord se envía en segundo plano: consulta su estado unas cuantas veces
+async function checkWebhook(id, msgDiv) {
+  for (let i = 0; i < 4; i++) {
+    await new Promise(r => setTimeout(r, 1000));
+    try {
+      const res = await fetch(`/api/sanciones/${id}/webhook`);
+      const d = await res.json();
+      if (d.webhook === "enviado") {
+        msgDiv.innerText = "✅ Sanción guardada y enviada a Discord";
+        return;
+      }
+      if (d.webhook === "fallido") {
+        msgDiv.className = "msg-error";
+        msgDiv.innerText = "⚠️ Sanción guardada, pero Discord rechazó el aviso";
+        return;
+      }
+    } catch (e) {
+      return;
+    }
+  }
+}
+
+// Campos que pinta el historial: el servidor no envía el resto
+const HISTORIAL_FIELDS = "id,fecha,created_at,accion,objetivo,discord_id,moderador,motivo";
+let historialCursor = null;
+let historialNewest = null;
+let historialIds = new Set();   // los ids no llegan en orden: se deduplica por id
+let feed = null;
+
+function escapeHtml(s) {
+  return String(s ?? "").replace(/[&<>"']/g, c => ({
+    "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;"
+  })[c]);
+}
+
+function renderEntry(r) {
+  // Formatea la fecha para que sea más legible
+  const fecha = new Date(r.fecha || r.created_at).toLocaleString('es-ES', {
+      day: '2-digit', month: '2-digit', year: 'numeric',
+      hour: '2-digit', minute: '2-digit'
+  });
+
+  const objetivo = r.discord_id ? `${r.objetivo} (ID: ${r.discord_id})` : r.objetivo;
+
+  return `<div class="entry">
+    <strong>${escapeHtml(r.accion.toUpperCase())}</strong> — ${escapeHtml(objetivo)} <br/>
+    <small>${escapeHtml(r.moderador)} • ${fecha}</small>
+    <div class="motivo">${escapeHtml(r.motivo)}</div>
+  </div>`;
+}
+
+// Sin argumentos recarga la primera página; con more=true añade la siguiente
+async function loadHistorial(more = false) {
   const hist = document.getElementById("historial");
-  hist.innerText = "Cargando...";
+  const loadMore = document.getElementById("load-more");
+  const params = new URLSearchParams({ limit: 20, fields: HISTORIAL_FIELDS });
+  if (more === true && historialCursor) {
+    params.set("before_id", historialCursor);
+  } else {
+    more = false;
+    hist.innerText = "Cargando...";
+  }
+  loadMore.disabled = true;
   try {
-    const res = await fetch("/api/sanciones");
+    const res = await fetch("/api/sanciones?" + params);
     const d = await res.json();
     if (!d.ok) {
-      hist.innerText = "Error: No autorizado";
+      hist.innerText = "Error: " + (d.msg || "No autorizado");
       return;
     }
-    const rows = d.data.slice(0, 20); // Muestra solo los últimos 20
-    
-    if (rows.length === 0) {
+
+    if (!more) historialIds = new Set();
+    d.data.forEach(r => historialIds.add(r.id));
+    if (!more && d.data.length === 0) {
       hist.innerText = "No hay registros todavía.";
+      loadMore.hidden = true;
       return;
     }
-    
-    // Mapea los datos a HTML
-    hist.innerHTML = rows.map(r => {
-      // Formatea la fecha para que sea más legible
-      const fecha = new Date(r.fecha || r.created_at).toLocaleString('es-ES', {
-          day: '2-digit', month: '2-digit', year: 'numeric',
-          hour: '2-digit', minute: '2-digit'
-      });
-      
-      return `<div class="entry">
-        <strong>${r.accion.toUpperCase()}</strong> — ${r.objetivo} <br/>
-        <small>${r.moderador} • ${fecha}</small>
-        <div class="motivo">${r.motivo}</div>
-      </div>`;
-    }).join("");
-    
+
+    const html = d.data.map(renderEntry).join("");
+    if (more) {
+      hist.insertAdjacentHTML("beforeend", html);
+    } else {
+      hist.innerHTML = html;
+      historialNewest = d.data[0].id;
+    }
+    historialCursor = d.next_before_id;
+    loadMore.hidden = !d.has_more;
+
   } catch (e) {
     hist.innerText = "Error cargando historial: " + e.message;
+  } finally {
+    loadMore.disabled = false;
+  }
+}
+
+// Feed en vivo: el servidor empuja cada sanción nueva y se añade arriba sin recargar la lista
+function startFeed() {
+  if (!window.EventSource) return;
+  const url = "/api/sanciones/stream" + (historialNewest ? "?last_id=" + historialNewest : "");
+  feed = new EventSource(url);
+  feed.onmessage = ev => {
+    const r = JSON.parse(ev.data);
+    if (historialIds.has(r.id)) return;
+    const hist = document.getElementById("historial");
+    if (!historialIds.size) hist.innerHTML = "";
+    historialIds.add(r.id);
+    hist.insertAdjacentHTML("afterbegin", renderEntry(r));
+    historialNewest = r.id;
+  };
+  // El servidor no puede garantizar que no falte nada: se recarga la lista y se vuelve a suscribir
+  feed.addEventListener("reload", async () => {
+    feed.close();
+    await loadHistorial();
+    startFeed();
+  });
+}
+
+// Estadísticas: el navegador revalida con ETag, así que repetir la consulta es barato
+async function loadStats() {
+  const box = document.getElementById("stats");
+  try {
+    const res = await fetch("/api/stats");
+    const d = await res.json();
+    if (!d.ok) {
+      box.innerText = "Error: " + (d.msg || "No autorizado");
+      return;
+    }
+    const rows = (items, label) => items.map(i =>
+      `<div class="row"><span>${escapeHtml(label(i))}</span><strong>${i.total}</strong></div>`
+    ).join("") || "<small>Sin datos</small>";
+    const max = Math.max(1, ...d.dias.map(x => x.total));
+
+    box.innerHTML = `
+      <div><h3>Total</h3><div class="stat-total">${d.total}</div></div>
+      <div><h3>Últimos 30 días</h3><div class="bars">${d.dias.map(x =>
+        `<div style="height:${100 * x.total / max}%" title="${x.dia}: ${x.total}"></div>`).join("")}</div></div>
+      <div><h3>Por moderador</h3>${rows(d.moderadores, i => i.moderador)}</div>
+      <div><h3>Por acción</h3>${rows(d.acciones, i => `${i.accion} · ${i.gravedad}`)}</div>
+      <div><h3>Reincidentes</h3>${rows(d.reincidentes, i => `${i.objetivo} (${i.discord_id})`)}</div>`;
+  } catch (e) {
+    box.innerText = "Error cargando estadísticas: " + e.message;
   }
 }
 
 // Carga el historial en cuanto la página esté lista
-window.addEventListener("load", loadHistorial);
\ No newline at end of file
+window.addEventListener("load", async () => {
+  loadStats();
+  setInterval(loadStats, 60000);
+  await loadHistorial();
+  startFeed();
+});
\ No newline at end of file
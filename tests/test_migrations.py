@@ -0,0 +1,70 @@
+# Helpers puros de la migración v2 (texto -> columnas tipadas); no necesitan Postgres.
+import os
+import sys
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import LEGACY_OBJETIVO_RE, _legacy_row, _legacy_ts  # noqa: E402
+
+MADRID = ZoneInfo("Europe/Madrid")
+CREATED = "2024-01-15 10:00:00"
+
+
+def test_objetivo_regex_separa_nombre_e_id():
+    m = LEGACY_OBJETIVO_RE.match("Pepe (el malo) (ID: 123456789012345678)")
+    assert m.groups() == ("Pepe (el malo)", "123456789012345678")
+
+
+def test_objetivo_regex_sin_id():
+    assert LEGACY_OBJETIVO_RE.match("Pepe") is None
+    assert LEGACY_OBJETIVO_RE.match("Pepe (ID: abc)") is None
+    assert LEGACY_OBJETIVO_RE.match("Pepe (ID: 12345678901234567890)") is None
+
+
+def test_legacy_row_extrae_discord_id():
+    discord_id, objetivo, _, _ = _legacy_row("Pepe (ID: 42)", None, CREATED, MADRID)
+    assert (discord_id, objetivo) == (42, "Pepe")
+
+
+def test_legacy_row_id_fuera_de_bigint_se_queda_en_el_texto():
+    texto = f"Pepe (ID: {2**63})"
+    discord_id, objetivo, _, _ = _legacy_row(texto, None, CREATED, MADRID)
+    assert (discord_id, objetivo) == (None, texto)
+    discord_id, _, _, _ = _legacy_row(f"Pepe (ID: {2**63 - 1})", None, CREATED, MADRID)
+    assert discord_id == 2**63 - 1
+
+
+def test_legacy_row_fecha_del_formulario_en_hora_local():
+    _, _, fecha_tz, _ = _legacy_row("Pepe", "2024-07-01T12:30", CREATED, MADRID)
+    assert fecha_tz == datetime(2024, 7, 1, 10, 30, tzinfo=timezone.utc)
+
+
+def test_legacy_row_fecha_de_utcnow_en_utc():
+    _, _, fecha_tz, created_tz = _legacy_row("Pepe", "2024-07-01 12:30:00.123456", CREATED, MADRID)
+    assert fecha_tz == datetime(2024, 7, 1, 12, 30, 0, 123456, tzinfo=timezone.utc)
+    assert created_tz == datetime(2024, 1, 15, 10, 0, tzinfo=timezone.utc)
+
+
+def test_legacy_ts_vacio_o_basura():
+    assert _legacy_ts(None) is None
+    assert _legacy_ts("") is None
+    assert _legacy_ts("ayer por la tarde") is None
+    assert _legacy_ts("2024-13-45T99:99") is None
+
+
+def test_legacy_ts_respeta_offset_explicito():
+    assert _legacy_ts("2024-07-01T12:30+02:00", MADRID) == datetime(2024, 7, 1, 10, 30, tzinfo=timezone.utc)
+
+
+def test_legacy_row_fechas_invalidas_caen_a_created_at_o_ahora():
+    _, _, fecha_tz, created_tz = _legacy_row("Pepe", "basura", CREATED, MADRID)
+    assert fecha_tz is None
+    assert created_tz == datetime(2024, 1, 15, 10, 0, tzinfo=timezone.utc)
+
+    _, _, fecha_tz, created_tz = _legacy_row("Pepe", "2024-07-01T12:30", "", MADRID)
+    assert created_tz == fecha_tz
+
+    antes = datetime.now(timezone.utc)
+    _, _, fecha_tz, created_tz = _legacy_row("Pepe", "", "basura", MADRID)
+    assert fecha_tz is None and created_tz >= antes
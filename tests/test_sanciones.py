@@ -0,0 +1,76 @@
+# Validación de las sanciones que llegan por JSON; no necesita Postgres.
+import os
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import sancion_from_json  # noqa: E402
+
+
+def test_valores_por_defecto():
+    item = sancion_from_json({}, "mod")
+    assert item["objetivo"] == "—"
+    assert (item["accion"], item["gravedad"], item["conteo"]) == ("sancionar", "Media", 0)
+    assert item["discord_id"] is None
+    assert item["moderador"] == "mod"
+    assert item["fecha"].tzinfo is not None
+
+
+def test_campos_completos():
+    item = sancion_from_json({
+        "fecha": "2024-07-01T12:30:00+02:00", "objetivo": "Pepe", "user_id": " 123456789012345678 ",
+        "accion": "advertir", "motivo": "spam", "gravedad": "Alta", "conteo": "3", "pruebas": "https://x",
+    }, "mod")
+    assert item["fecha"] == datetime(2024, 7, 1, 10, 30, tzinfo=timezone.utc)
+    assert item["discord_id"] == 123456789012345678
+    assert (item["objetivo"], item["motivo"], item["pruebas"]) == ("Pepe", "spam", "https://x")
+    assert item["conteo"] == 3
+
+
+def test_numeros_se_guardan_como_texto():
+    item = sancion_from_json({"objetivo": 42, "motivo": 1.5, "pruebas": 0}, "mod")
+    assert (item["objetivo"], item["motivo"], item["pruebas"]) == ("42", "1.5", "0")
+
+
+@pytest.mark.parametrize("campo", ["objetivo", "motivo", "pruebas"])
+@pytest.mark.parametrize("valor", [{"a": 1}, ["a"], True])
+def test_textos_que_no_son_texto(campo, valor):
+    with pytest.raises(ValueError, match=campo):
+        sancion_from_json({campo: valor}, "mod")
+
+
+@pytest.mark.parametrize("data", [
+    {"accion": "banear"},
+    {"accion": ["sancionar"]},
+    {"gravedad": "Enorme"},
+    {"gravedad": {"x": 1}},
+])
+def test_accion_y_gravedad_desconocidas(data):
+    with pytest.raises(ValueError, match="desconocida"):
+        sancion_from_json(data, "mod")
+
+
+@pytest.mark.parametrize("conteo", [-1, 2**31, "99999999999"])
+def test_conteo_fuera_de_rango(conteo):
+    with pytest.raises(ValueError, match="fuera de rango"):
+        sancion_from_json({"conteo": conteo}, "mod")
+
+
+@pytest.mark.parametrize("conteo", ["tres", {"n": 1}, [1]])
+def test_conteo_no_valido(conteo):
+    with pytest.raises(ValueError, match="Conteo no válido"):
+        sancion_from_json({"conteo": conteo}, "mod")
+
+
+@pytest.mark.parametrize("fecha", ["ayer", {"d": 1}, 12])
+def test_fecha_no_valida(fecha):
+    with pytest.raises(ValueError, match="Fecha"):
+        sancion_from_json({"fecha": fecha}, "mod")
+
+
+@pytest.mark.parametrize("user_id", ["abc", str(2**63), "12345678901234567890", {"id": 1}])
+def test_discord_id_no_valida(user_id):
+    with pytest.raises(ValueError, match="ID de Discord"):
+        sancion_from_json({"user_id": user_id}, "mod")